@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Image, WebPage, AsyncResults
+from .models import Image, WebPage, WebPageChange, AsyncResults
 
 
 @admin.register(WebPage)
@@ -7,6 +7,11 @@ class WebPageAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(WebPageChange)
+class WebPageChangeAdmin(admin.ModelAdmin):
+    pass
+
+
 @admin.register(Image)
 class ImagePageAdmin(admin.ModelAdmin):
     pass
@@ -0,0 +1,147 @@
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+
+class BudgetExceeded(Exception):
+    """Raised when a task used up its budget, holds the reason for stopping."""
+
+
+class ImageTooLarge(Exception):
+    """Raised when a single image is larger than allowed, only that image is dropped."""
+
+
+class DownloadBudget:
+    """
+    Limits of resources a single task may use while downloading a website and its images.
+    The deadline counts from the budget's creation. Limits set to None are not enforced.
+    """
+    LIMITS = ["max_html_bytes", "max_total_bytes", "max_images", "max_image_bytes", "connect_timeout",
+              "read_timeout", "deadline"]
+
+    def __init__(self, max_html_bytes=None, max_total_bytes=None, max_images=None, max_image_bytes=None,
+                 connect_timeout=None, read_timeout=None, deadline=None):
+        self.max_html_bytes = max_html_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_images = max_images
+        self.max_image_bytes = max_image_bytes
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline_at = time.monotonic() + deadline if deadline is not None else None
+        self.total_bytes = 0
+        self.images = 0
+
+    @classmethod
+    def from_settings(cls, overrides=None):
+        """
+        Function used to create a budget from SCRAPER_DOWNLOAD_BUDGET setting.
+        Overrides can only tighten the configured limits.
+        :param overrides: dictionary of limits requested for a single task,
+        :return: DownloadBudget instance.
+        """
+        limits = dict(settings.SCRAPER_DOWNLOAD_BUDGET)
+        for name, value in (overrides or {}).items():
+            limits[name] = value if limits.get(name) is None else min(limits[name], value)
+        return cls(**limits)
+
+    @classmethod
+    def validate_overrides(cls, overrides):
+        """
+        Function used to validate limits sent in a scrape request.
+        :param overrides: dictionary of limits,
+        :return: error message as a string, None if the limits are valid.
+        """
+        if not isinstance(overrides, dict):
+            return "budget must be an object"
+        for name, value in overrides.items():
+            if name not in cls.LIMITS:
+                return f"unknown budget limit: {name}"
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                return f"{name} must be a positive number"
+        return None
+
+    def remaining_time(self):
+        """
+        Function used to compute how much time is left until the deadline.
+        :return: number of seconds, None if there is no deadline.
+        """
+        if self.deadline_at is None:
+            return None
+        return max(self.deadline_at - time.monotonic(), 0)
+
+    def check_deadline(self):
+        if self.deadline_at is not None and time.monotonic() > self.deadline_at:
+            raise BudgetExceeded("deadline reached")
+
+    def check_html_size(self, html_bytes):
+        """
+        Function used to stop downloading a website which is larger than allowed.
+        :param html_bytes: size of the HTML content downloaded so far.
+        """
+        if self.max_html_bytes is not None and html_bytes > self.max_html_bytes:
+            raise BudgetExceeded(f"HTML page larger than {self.max_html_bytes} bytes")
+        self.check_deadline()
+
+    def check(self):
+        """Function used before each image to stop the task once any of the budget's limits is reached."""
+        self.check_deadline()
+        if self.max_images is not None and self.images >= self.max_images:
+            raise BudgetExceeded("image count limit reached")
+        if self.max_total_bytes is not None and self.total_bytes >= self.max_total_bytes:
+            raise BudgetExceeded("total size limit reached")
+
+    def check_image_size(self, image_bytes):
+        """
+        Function used to reject an image which is larger than allowed.
+        :param image_bytes: image size in bytes, declared or downloaded so far.
+        """
+        if self.max_image_bytes is not None and image_bytes > self.max_image_bytes:
+            raise ImageTooLarge(f"image larger than {self.max_image_bytes} bytes")
+
+    def consume(self, block_bytes, image_bytes):
+        """
+        Function used to account a downloaded block of an image.
+        :param block_bytes: size of the block in bytes,
+        :param image_bytes: size of the image downloaded so far, including the block.
+        """
+        self.total_bytes += block_bytes
+        self.check_image_size(image_bytes)
+        if self.max_total_bytes is not None and self.total_bytes > self.max_total_bytes:
+            raise BudgetExceeded("total size limit reached")
+        self.check_deadline()
+
+
+class DeadlineWatchdog:
+    """
+    Shuts the connection of a streamed response down once the budget's deadline passes.
+    Read timeout only limits a single socket read, so a server trickling data could otherwise
+    keep a read of one block, and the worker, busy for much longer than the deadline.
+    """
+
+    def __init__(self, response, budget=None):
+        self.response = response
+        self.expired = False
+        self.timer = None
+        remaining_time = budget.remaining_time() if budget else None
+        if remaining_time is not None:
+            self.timer = threading.Timer(remaining_time, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def expire(self):
+        self.expired = True
+        # Shutting the socket down wakes up a read blocked on it, closing the response alone does not.
+        connection = getattr(self.response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+            else:
+                self.response.close()
+        except OSError:
+            pass
+
+    def cancel(self):
+        if self.timer:
+            self.timer.cancel()
@@ -0,0 +1,68 @@
+import hashlib
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.response import Response
+
+WEBPAGE_LIST_VERSION_KEY = "webpage-list-version"
+
+
+def webpage_version_key(pk):
+    return f"webpage-version:{pk}"
+
+
+def get_version(version_key):
+    """
+    Function used to retrieve current version token of cached payloads.
+    A new random token is created when there is none, so an evicted version never matches an old ETag.
+    Tokens expire with the payloads they version.
+    :param version_key: cache key holding the version token,
+    :return: version token as a string.
+    """
+    version = uuid4().hex
+    if cache.add(version_key, version, timeout=settings.SCRAPER_CACHE_TIMEOUT):
+        return version
+    return cache.get(version_key, version)
+
+
+def invalidate_webpage(pk):
+    """
+    Function used to drop cached payloads of a webpage and of the webpage list.
+    :param pk: primary key of modified WebPage instance.
+    """
+    cache.delete_many([webpage_version_key(pk), WEBPAGE_LIST_VERSION_KEY])
+
+
+def cached_response(request, version_key, build_payload, exists=None):
+    """
+    Function used to respond with a cached serialized payload, or with 304 status code
+    if the client already holds the current version of it.
+    :param request: incoming request,
+    :param version_key: cache key holding the version token of the payload,
+    :param build_payload: function returning serialized payload, called only on a cache miss,
+    :param exists: function telling whether the resource exists, checked before a version token is created for it,
+    :return: Response instance with an ETag header.
+    """
+    version = cache.get(version_key)
+    if version is None:
+        # Tokens are dropped when the resource is deleted, so only a missing token needs checking.
+        if exists is not None and not exists():
+            raise Http404
+        version = get_version(version_key)
+    etag = f'"{version}"'
+    conditional_response = get_conditional_response(request, etag=etag)
+    if conditional_response is not None:
+        conditional_response["ETag"] = etag
+        return conditional_response
+
+    # Payload holds absolute urls and pagination links, so the whole request url is a part of the key.
+    payload_key = hashlib.md5(f"{version_key}:{version}:{request.build_absolute_uri()}".encode()).hexdigest()
+    payload = cache.get(f"payload:{payload_key}")
+    if payload is None:
+        payload = build_payload()
+        cache.set(f"payload:{payload_key}", payload, settings.SCRAPER_CACHE_TIMEOUT)
+    return Response(payload, status=status.HTTP_200_OK, headers={"ETag": etag})
@@ -0,0 +1,73 @@
+import difflib
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import WebPage, WebPageChange
+
+
+def compact_diff(old_text, new_text):
+    """
+    Function used to create a unified diff of two texts without any context lines.
+    :param old_text: previously saved text,
+    :param new_text: freshly downloaded text,
+    :return: diff as a string.
+    """
+    return "\n".join(difflib.unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="", n=0))
+
+
+def save_text(url, text):
+    """
+    Function used to save downloaded text only if it differs from the saved one.
+    Every change is recorded as a WebPageChange instance holding the text's hash and a diff.
+    :param url: website's url as a string,
+    :param text: website's text as a string,
+    :return: tuple of WebPage instance and a boolean telling whether the text changed.
+    """
+    content_hash = hashlib.sha256(text.encode()).hexdigest()
+    webpage = WebPage.objects.get_or_create(url=url)[0]
+    if webpage.content_hash == content_hash:
+        return webpage, False
+
+    with transaction.atomic():
+        WebPageChange.objects.create(
+            webpage=webpage,
+            content_hash=content_hash,
+            diff=compact_diff(webpage.text or "", text))
+        webpage.text = text
+        webpage.content_hash = content_hash
+        webpage.save()
+    return webpage, True
+
+
+def schedule_next_fetch(webpage, changed, rescrape_interval=None):
+    """
+    Function used to plan the next re-scrape of a webpage.
+    Interval is reset to the base one when the page changed and doubled, up to SCRAPER_MAX_RESCRAPE_INTERVAL,
+    when it did not, so rarely changing pages are checked less often.
+    Fields are updated with a queryset so cached payloads and updated_at are left untouched.
+    :param webpage: WebPage instance,
+    :param changed: whether the text changed, None if it could not be downloaded,
+    :param rescrape_interval: new base interval as a timedelta, None keeps the current one.
+    """
+    now = timezone.now()
+    fields = {"last_fetched_at": now}
+
+    if rescrape_interval is not None:
+        webpage.rescrape_interval = rescrape_interval
+        webpage.rescrape_current_interval = rescrape_interval
+    elif webpage.rescrape_interval and changed:
+        webpage.rescrape_current_interval = webpage.rescrape_interval
+    elif webpage.rescrape_interval and changed is False:
+        webpage.rescrape_current_interval = min(webpage.rescrape_current_interval * 2,
+                                                max(settings.SCRAPER_MAX_RESCRAPE_INTERVAL, webpage.rescrape_interval))
+
+    if webpage.rescrape_interval:
+        fields.update({
+            "rescrape_interval": webpage.rescrape_interval,
+            "rescrape_current_interval": webpage.rescrape_current_interval,
+            "next_fetch_at": now + webpage.rescrape_current_interval,
+        })
+    WebPage.objects.filter(pk=webpage.pk).update(**fields)
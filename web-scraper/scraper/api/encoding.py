@@ -0,0 +1,133 @@
+import codecs
+import re
+import time
+from urllib.parse import urlparse
+
+import chardet
+from django.core.cache import cache
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Labels browsers decode with a superset encoding, as pages labelled e.g. latin-1 are usually windows-1252.
+# https://encoding.spec.whatwg.org/#names-and-labels
+SUPERSET_ENCODINGS = {
+    "ascii": "cp1252",
+    "iso8859-1": "cp1252",
+    "iso8859-9": "cp1254",
+    "tis-620": "cp874",
+}
+
+CHARSET_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+# Declarations in <meta> tags are looked for only in this many first bytes of a document.
+META_SNIFF_BYTES = 4096
+# Statistical detection is run on this many first bytes of a document.
+DETECTION_SAMPLE_BYTES = 64 * 1024
+
+
+def normalize_encoding(encoding):
+    """
+    Function used to turn an encoding label into a Python codec name.
+    Labels which browsers treat as their superset encodings are replaced with those.
+    :param encoding: encoding label as a string or bytes,
+    :return: codec name, None if the label is not a known encoding.
+    """
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode("ascii", "ignore")
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return None
+    return SUPERSET_ENCODINGS.get(name, name)
+
+
+def sniff_encoding(content, content_type=None):
+    """
+    Function used to find an encoding declared by a BOM, the Content-Type header or a <meta> tag, in this order.
+    :param content: raw HTML content as bytes,
+    :param content_type: value of the Content-Type response header,
+    :return: codec name, None if no known encoding is declared.
+    """
+    for bom, encoding in BOMS:
+        if content.startswith(bom):
+            return encoding
+
+    if content_type:
+        match = CHARSET_RE.search(content_type)
+        if match and normalize_encoding(match.group(1)):
+            return normalize_encoding(match.group(1))
+
+    match = META_CHARSET_RE.search(content[:META_SNIFF_BYTES])
+    if match:
+        return normalize_encoding(match.group(1))
+    return None
+
+
+def try_decode(content, encoding):
+    try:
+        return content.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+
+def get_domain_encoding(page_url):
+    """
+    Function used to retrieve the encoding previously detected for a website's domain.
+    It is called in the worker, not in parsing processes, which must not share the worker's cache connections.
+    :param page_url: url the content was downloaded from,
+    :return: name of the encoding, None if none was detected yet.
+    """
+    return cache.get(f"encoding:{urlparse(page_url).netloc}") if page_url else None
+
+
+def remember_domain_encoding(page_url, decoding):
+    """
+    Function used to remember a statistically detected encoding for the website's domain.
+    :param page_url: url the content was downloaded from,
+    :param decoding: dictionary describing the decoding, returned by decode_html.
+    """
+    if page_url and decoding["encoding_source"] == "detected":
+        cache.set(f"encoding:{urlparse(page_url).netloc}", decoding["encoding"], None)
+
+
+def decode_html(content, content_type=None, domain_encoding=None):
+    """
+    Function used to decode HTML content before it is parsed, so BeautifulSoup does not have to detect its encoding.
+    Declared encoding is used first, then UTF-8, which rarely decodes other encodings without errors,
+    then the one previously detected for the same domain, and only if all of them fail
+    the encoding is detected statistically.
+    :param content: raw HTML content as bytes,
+    :param content_type: value of the Content-Type response header,
+    :param domain_encoding: encoding previously detected for the website's domain,
+    :return: tuple of decoded text and a dictionary holding used encoding, its source and decode time in seconds.
+    """
+    start = time.perf_counter()
+
+    def decoded(text, encoding, source):
+        return text, {"encoding": encoding, "encoding_source": source, "decode_time": time.perf_counter() - start}
+
+    declared_encoding = sniff_encoding(content, content_type)
+    if declared_encoding:
+        text = try_decode(content, declared_encoding)
+        if text is not None:
+            return decoded(text, declared_encoding, "declared")
+
+    text = try_decode(content, "utf-8")
+    if text is not None:
+        return decoded(text, "utf-8", "utf-8")
+
+    if domain_encoding:
+        text = try_decode(content, domain_encoding)
+        if text is not None:
+            return decoded(text, domain_encoding, "domain cache")
+
+    detected_encoding = normalize_encoding(chardet.detect(content[:DETECTION_SAMPLE_BYTES])["encoding"] or "")
+    detected_encoding = detected_encoding or "windows-1252"
+    return decoded(content.decode(detected_encoding, errors="replace"), detected_encoding, "detected")
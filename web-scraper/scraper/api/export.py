@@ -0,0 +1,64 @@
+import json
+from collections import defaultdict
+
+from ..models import Image, WebPage
+
+
+def get_export_queryset(since_id=None, since=None):
+    """
+    Function used to select webpages for an export, ordered so an export can be resumed by id.
+    :param since_id: only webpages with a greater id are exported,
+    :param since: only webpages updated after this datetime are exported,
+    :return: WebPage queryset.
+    """
+    webpages = WebPage.objects.order_by("id")
+    if since_id is not None:
+        webpages = webpages.filter(id__gt=since_id)
+    if since is not None:
+        webpages = webpages.filter(updated_at__gt=since)
+    return webpages
+
+
+def iter_records(webpages, chunk_size=500):
+    """
+    Generator used to turn webpages into plain dictionaries without loading the whole queryset into memory.
+    Webpages are read with a server-side cursor and images are fetched with one query per chunk.
+    :param webpages: WebPage queryset,
+    :param chunk_size: number of webpages fetched from the database at once,
+    :return: generator of dictionaries holding webpage's data and names of its images.
+    """
+    chunk = []
+    for webpage in webpages.iterator(chunk_size=chunk_size):
+        chunk.append(webpage)
+        if len(chunk) == chunk_size:
+            yield from _chunk_records(chunk)
+            chunk = []
+    if chunk:
+        yield from _chunk_records(chunk)
+
+
+def _chunk_records(chunk):
+    images = defaultdict(list)
+    images_names = Image.objects.filter(webpage_id__in=[webpage.id for webpage in chunk]) \
+        .order_by("id").values_list("webpage_id", "image")
+    for webpage_id, image_name in images_names:
+        images[webpage_id].append(image_name)
+
+    for webpage in chunk:
+        yield {
+            "id": webpage.id,
+            "url": webpage.url,
+            "text": webpage.text,
+            "updated_at": webpage.updated_at.isoformat(),
+            "images": images[webpage.id],
+        }
+
+
+def iter_ndjson(records):
+    """
+    Generator used to encode records as newline delimited JSON.
+    :param records: iterable of dictionaries,
+    :return: generator of JSON lines as strings.
+    """
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
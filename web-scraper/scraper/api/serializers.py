@@ -1,6 +1,9 @@
-from ..models import AsyncResults, Image, WebPage
+from django.conf import settings
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
 
+from ..models import AsyncResults, Image, WebPage
+
 
 class ImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
@@ -10,6 +13,8 @@ class ImageSerializer(serializers.ModelSerializer):
         fields = ["image_url"]
 
     def get_image_url(self, image):
+        if settings.SCRAPER_IMAGE_CDN_URL:
+            return f"{settings.SCRAPER_IMAGE_CDN_URL.rstrip('/')}/{filepath_to_uri(image.image.name)}"
         request = self.context.get("request")
         image_url = image.image.url
         return request.build_absolute_uri(image_url)
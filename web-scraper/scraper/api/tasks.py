@@ -1,53 +1,87 @@
 import json
+from datetime import timedelta
 
 from celery import shared_task
+from django.utils import timezone
 
-from .util import download_images_from_url, scrape_images, scrape_text
+from .budget import BudgetExceeded, DownloadBudget
+from .changes import save_text, schedule_next_fetch
+from .util import ParsingError, download_images_from_url, scrape_images, scrape_text
 from ..models import AsyncResults, WebPage
 
 
 @shared_task(bind=True)
-def download_text(self, url):
+def download_text(self, url, rescrape_interval=None):
     """
     Asynchronous task handled with Celery to download and save HTML text content in the database.
+    Text is saved and a change is recorded only when it differs from the saved one.
     To hold current task status an AsyncResults instance is created and modified.
-    :param url - website url as a string.
+    :param url - website url as a string,
+    :param rescrape_interval - optional number of seconds after which the website is scraped again.
     """
     task_id = self.request.id
     task_status = AsyncResults.objects.create(
         task_id=task_id,
         result={"status_message": "Requesting url"})
+    if rescrape_interval is not None:
+        rescrape_interval = timedelta(seconds=rescrape_interval)
     try:
-        text = scrape_text(url, task_status)
-    except ConnectionError as e:
+        text, decoding = scrape_text(url, task_status, DownloadBudget.from_settings())
+    except (ConnectionError, ParsingError, BudgetExceeded) as e:
         result = {"status_code": 500,
                   "status_message": "Failed to download text",
                   "error_message": str(e)}
+        webpage = WebPage.objects.filter(url=url).first()
+        if webpage:
+            schedule_next_fetch(webpage, None, rescrape_interval)
     else:
         task_status.result = {"status_message": "Saving text in database"}
         task_status.save()
-        WebPage.objects.update_or_create(url=url, defaults={"url": url, "text": text})
+        webpage, changed = save_text(url, text)
+        schedule_next_fetch(webpage, changed, rescrape_interval)
 
         result = {"status_code": 200,
-                  "status_message": "Download complete"}
+                  "status_message": "Download complete" if changed else "Page not changed",
+                  "changed": changed,
+                  **decoding}
     task_status.result = result
     task_status.save()
 
 
+@shared_task
+def rescrape_due_webpages():
+    """
+    Periodic task run by Celery beat to queue download_text for webpages whose next fetch time has passed.
+    Next fetch time is moved forward right away, so a page is not queued twice while waiting for a worker.
+    :return: number of queued webpages.
+    """
+    now = timezone.now()
+    due_webpages = WebPage.objects.filter(next_fetch_at__lte=now).only("id", "url", "rescrape_current_interval")
+    queued = 0
+    for webpage in due_webpages:
+        WebPage.objects.filter(pk=webpage.pk).update(next_fetch_at=now + webpage.rescrape_current_interval)
+        download_text.delay(webpage.url)
+        queued += 1
+    return queued
+
+
 @shared_task(bind=True)
-def download_images(self, url):
+def download_images(self, url, budget=None):
     """
     Asynchronous task handled with Celery to download and save images from HTML content.
     To hold current task status an AsyncResults instance is created and modified.
-    :param url - website url as a string.
+    :param url - website url as a string,
+    :param budget - optional dictionary of limits tightening SCRAPER_DOWNLOAD_BUDGET setting for this task.
     """
     task_id = self.request.id
     task_status = AsyncResults.objects.create(
         task_id=task_id,
         result={"status_message": "Requesting url"})
+    # Budget is created before the website is requested, so its deadline covers the whole task.
+    budget = DownloadBudget.from_settings(budget)
     try:
-        images_urls = scrape_images(url, task_status)
-    except ConnectionError as e:
+        images_urls, decoding = scrape_images(url, task_status, budget)
+    except (ConnectionError, ParsingError, BudgetExceeded) as e:
         result = {"status_code": 500,
                   "status_message": "Failed to download images",
                   "error_message": str(e)}
@@ -56,13 +90,17 @@ def download_images(self, url):
         task_status.save()
         webpage = WebPage.objects.get_or_create(url=url)[0]
 
-        image_count = download_images_from_url(webpage, images_urls, task_status)
+        image_count = download_images_from_url(webpage, images_urls, task_status, budget)
+        webpage.save(update_fields=["updated_at"])
 
         result = {
             "status_code": 200,
-            "status_message": "Download complete",
+            "status_message": "Download stopped early" if image_count["stop_reason"] else "Download complete",
             "images_downloaded": image_count["download_success"],
-            "images_failed_to_download": image_count["download_failure"]
+            "images_failed_to_download": image_count["download_failure"],
+            "images_skipped": image_count["download_skipped"],
+            "stop_reason": image_count["stop_reason"],
+            **decoding
         }
     task_status.result = task_status.result = result
     task_status.save()
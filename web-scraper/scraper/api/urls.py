@@ -1,6 +1,7 @@
 from django.urls import path
 
-from .views import TaskStatusDetailView, ImageScrapeView, TextScrapeView, WebPageDetailView, WebPageListView
+from .views import (TaskStatusDetailView, ImageScrapeView, TextScrapeView, WebPageDetailView, WebPageExportView,
+                    WebPageListView)
 
 urlpatterns = [
     path("scrape/text/", TextScrapeView.as_view(), name="scrape-text"),
@@ -9,6 +10,8 @@ urlpatterns = [
 
     path("webpages/", WebPageListView.as_view(), name="webpage-list"),
 
+    path("webpages/export/", WebPageExportView.as_view(), name="webpage-export"),
+
     path("webpages/<int:pk>/", WebPageDetailView.as_view(), name="webpage-detail"),
 
     path("task/<str:task_id>/", TaskStatusDetailView.as_view(), name="task-detail"),
@@ -1,26 +1,184 @@
-from tempfile import NamedTemporaryFile
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from urllib.parse import unquote_to_bytes, urljoin, urlparse
 
 import requests
+from botocore.exceptions import BotoCoreError, ClientError
 from bs4 import BeautifulSoup
+from django.conf import settings
 from django.core.files import File
+from django.core.files.base import ContentFile
 
+from .budget import BudgetExceeded, DeadlineWatchdog, DownloadBudget, ImageTooLarge
+from .encoding import decode_html, get_domain_encoding, remember_domain_encoding
 from ..models import Image
 
+BACKGROUND_URL_RE = re.compile(r"background(?:-image)?\s*:[^;]*?url\(\s*['\"]?([^'\")]+?)['\"]?\s*\)", re.IGNORECASE)
 
-def scrape_text(url, status_object):
+# Errors of saving an image in the storage, either on a local disk or in an object storage over the network.
+STORAGE_ERRORS = (OSError, BotoCoreError, ClientError)
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class ParsingError(Exception):
+    """Raised when HTML content could not be parsed in the process pool."""
+
+
+def get_parse_pool():
     """
-    Function used to retrieve text from an HTML content and remove all the tags.
+    Function to lazily create the process pool used for HTML parsing.
+    The pool is created once per worker process and reused by all the tasks it runs, also from many threads.
+    :return: ProcessPoolExecutor instance.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=settings.SCRAPER_PARSE_PROCESSES)
+        return _parse_pool
+
+
+def run_parser(parser, content):
+    """
+    Function used to run CPU-heavy parsing outside of the thread which waits on the network.
+    Parsing is done inline when SCRAPER_PARSE_PROCESSES setting is 0.
+    :param parser: picklable function taking HTML content as its only argument,
+    :param content: raw HTML content as bytes, passed to the parser as it is,
+    :return: value returned by the parser.
+    A broken pool is replaced and parsing retried once, ParsingError is raised if it fails again or times out.
+    """
+    if not settings.SCRAPER_PARSE_PROCESSES:
+        return parser(content)
+    pool = get_parse_pool()
+    try:
+        return pool.submit(parser, content).result(timeout=settings.SCRAPER_PARSE_TIMEOUT)
+    except BrokenProcessPool:
+        # A parsing process died (e.g. killed for running out of memory), the pool is unusable from now on.
+        reset_parse_pool(pool)
+    except TimeoutError:
+        reset_parse_pool(pool, timed_out=True)
+        raise ParsingError(f"Parsing took longer than {settings.SCRAPER_PARSE_TIMEOUT} seconds")
+
+    pool = get_parse_pool()
+    try:
+        return pool.submit(parser, content).result(timeout=settings.SCRAPER_PARSE_TIMEOUT)
+    except BrokenProcessPool as e:
+        reset_parse_pool(pool)
+        raise ParsingError(f"Parsing failed: {e!r}")
+    except TimeoutError:
+        reset_parse_pool(pool, timed_out=True)
+        raise ParsingError(f"Parsing took longer than {settings.SCRAPER_PARSE_TIMEOUT} seconds")
+
+
+def reset_parse_pool(failed_pool, timed_out=False):
+    """
+    Function used to drop a failed process pool, so the next run_parser call creates a new one.
+    Nothing is done if the pool was already replaced, e.g. by another thread which got the same error.
+    Processes of a broken pool are terminated right away. A pool with a stuck parse keeps running
+    the pages other tasks already sent to it for SCRAPER_PARSE_TIMEOUT seconds, then its processes are terminated.
+    :param failed_pool: ProcessPoolExecutor instance which raised the error,
+    :param timed_out: whether the pool is dropped because of a parse which took too long.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not failed_pool:
+            return
+        _parse_pool = None
+    failed_pool.shutdown(wait=False)
+    if timed_out:
+        timer = threading.Timer(settings.SCRAPER_PARSE_TIMEOUT, terminate_pool_processes, [failed_pool])
+        timer.daemon = True
+        timer.start()
+    else:
+        terminate_pool_processes(failed_pool)
+
+
+def terminate_pool_processes(pool):
+    # ProcessPoolExecutor has no public way of killing its processes.
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+
+
+def fetch_html(url, budget=None):
+    """
+    Function used to download HTML content of a website.
     :param url: website's url as a string,
-    :param status_object: an AsyncResult instance which holds current task state,
-    :return: website's text as a string.
+    :param budget: DownloadBudget instance limiting timeouts, time and size of the download,
+    limits from settings are used if not given,
+    :return: tuple of raw HTML content as bytes and value of Content-Type response header.
     """
-    results = requests.get(url)
-    if results.status_code != 200:
-        raise ConnectionError
+    budget = budget or DownloadBudget.from_settings()
+    budget.check_deadline()
+    try:
+        results = requests.get(url, stream=True, timeout=budget.timeout)
+    except requests.exceptions.RequestException as e:
+        raise ConnectionError(str(e))
 
-    status_object.result = {"status_message": "Processing HTML file"}
-    status_object.save()
-    soup = BeautifulSoup(results.content, 'lxml')
+    watchdog = DeadlineWatchdog(results, budget)
+    try:
+        if results.status_code != 200:
+            raise ConnectionError
+        content = bytearray()
+        for block in results.iter_content(8 * 1024):
+            content.extend(block)
+            budget.check_html_size(len(content))
+        if watchdog.expired:
+            raise BudgetExceeded("deadline reached")
+    except requests.exceptions.RequestException as e:
+        if watchdog.expired:
+            raise BudgetExceeded("deadline reached")
+        raise ConnectionError(str(e))
+    finally:
+        watchdog.cancel()
+        results.close()
+    return bytes(content), results.headers.get("Content-Type")
+
+
+def decode_and_parse(content, parser, content_type=None, domain_encoding=None):
+    """
+    Function used to decode raw HTML content and pass the text to a parser, run as a whole by run_parser.
+    :param content: raw HTML content as bytes,
+    :param parser: picklable function taking HTML text as its only argument,
+    :param content_type: value of the Content-Type response header,
+    :param domain_encoding: encoding previously detected for the website's domain,
+    :return: tuple of value returned by the parser and a dictionary describing the decoding.
+    """
+    text, decoding = decode_html(content, content_type, domain_encoding)
+    return parser(text), decoding
+
+
+def parse_html(content, parser, content_type, page_url):
+    """
+    Function used to decode and parse HTML content with run_parser.
+    Encoding detected for the website's domain is read and remembered here, outside of parsing processes.
+    :param content: raw HTML content as bytes,
+    :param parser: picklable function taking HTML text as its only argument,
+    :param content_type: value of the Content-Type response header,
+    :param page_url: url the content was downloaded from,
+    :return: tuple of value returned by the parser and a dictionary describing the decoding.
+    """
+    result, decoding = run_parser(partial(decode_and_parse, parser=parser, content_type=content_type,
+                                          domain_encoding=get_domain_encoding(page_url)), content)
+    remember_domain_encoding(page_url, decoding)
+    return result, decoding
+
+
+def extract_text(content):
+    """
+    Function used to retrieve text from an HTML content and remove all the tags.
+    :param content: raw HTML content,
+    :return: website's text as a string.
+    """
+    soup = BeautifulSoup(content, 'lxml')
 
     for not_allowed_tag in soup(["script", "style"]):
         not_allowed_tag.decompose()
@@ -28,77 +186,330 @@ def scrape_text(url, status_object):
     return soup.text
 
 
-def scrape_images(url, status_object):
+def parse_srcset(srcset):
     """
-    Function used to retrieve images' urls from a website.
-    :param url: website's url as a string,
-    :param status_object: an AsyncResult instance which holds current task state,
-    :return: list of urls as strings.
+    Function used to split a srcset attribute into image candidates, following the HTML standard's parsing rules,
+    so candidates separated by commas without any whitespace are recognized as well.
+    :param srcset: value of srcset attribute, e.g. "small.png 480w, large.png 800w",
+    :return: list of tuples of candidate's url and its descriptors as a string.
     """
-    results = requests.get(url)
+    candidates = []
+    position, length = 0, len(srcset)
+    while True:
+        while position < length and (srcset[position].isspace() or srcset[position] == ","):
+            position += 1
+        if position >= length:
+            return candidates
 
-    if results.status_code != 200:
-        raise ConnectionError
+        start = position
+        while position < length and not srcset[position].isspace():
+            position += 1
+        url = srcset[start:position]
+
+        descriptors = ""
+        if url.endswith(","):
+            url = url.rstrip(",")
+        else:
+            start = position
+            in_parentheses = False
+            while position < length and (srcset[position] != "," or in_parentheses):
+                if srcset[position] == "(":
+                    in_parentheses = True
+                elif srcset[position] == ")":
+                    in_parentheses = False
+                position += 1
+            descriptors = srcset[start:position].strip()
+        candidates.append((url, descriptors))
+
+
+def select_srcset_candidate(srcset):
+    """
+    Function used to pick the largest image candidate from a srcset attribute.
+    :param srcset: value of srcset attribute, e.g. "small.png 480w, large.png 800w",
+    :return: url of the candidate with the highest width or density descriptor, None if there is no valid candidate.
+    """
+    best_url, best_value = None, -1.0
+    for url, descriptors in parse_srcset(srcset):
+        descriptor = descriptors.split()[0] if descriptors else "1x"
+        if descriptor[-1:] not in ("w", "x"):
+            continue
+        try:
+            value = float(descriptor[:-1])
+        except ValueError:
+            continue
+        if value > best_value:
+            best_url, best_value = url, value
+    return best_url
 
-    status_object.result = {"status_message": "Processing HTML file"}
-    status_object.save()
-    soup = BeautifulSoup(results.content, 'lxml')
 
-    images = soup.find_all('img')
+def has_declared_size_below_minimum(image):
+    """
+    Function used to check whether an <img> tag declares width or height smaller than SCRAPER_MIN_IMAGE_SIZE.
+    Images without declared dimensions are never filtered out.
+    :param image: <img> tag,
+    :return: True if the image is too small to be worth downloading.
+    """
+    for attribute in ("width", "height"):
+        value = image.get(attribute, "").strip().rstrip("px")
+        if value.isdigit() and int(value) < settings.SCRAPER_MIN_IMAGE_SIZE:
+            return True
+    return False
+
+
+def resolve_image_url(url, base_url):
+    """
+    Function used to turn an image source found in HTML into an absolute url.
+    :param url: image source as written in HTML,
+    :param base_url: url against which relative sources are resolved,
+    :return: absolute http(s) url or data: URI, None if the source can not be downloaded.
+    """
+    url = url.strip()
+    if url.startswith("data:"):
+        return url
+    url = urljoin(base_url, url)
+    if urlparse(url).scheme not in ("http", "https"):
+        return None
+    return url
+
+
+def extract_images_urls(content, page_url):
+    """
+    Function used to retrieve distinct images' urls from an HTML content.
+    Sources are taken from <img> src, data-original and srcset attributes, <picture> sources
+    and inline CSS backgrounds, and resolved against the page's url or its <base> tag.
+    :param content: raw HTML content,
+    :param page_url: url the HTML content was downloaded from,
+    :return: list of urls as strings, in order of appearance and without duplicates.
+    """
+    soup = BeautifulSoup(content, 'lxml')
+
+    base = soup.find('base', href=True)
+    base_url = urljoin(page_url, base['href']) if base else page_url
+
+    sources = []
+
+    for image in soup.find_all('img'):
+        if has_declared_size_below_minimum(image):
+            continue
+        picture = image.find_parent('picture')
+        picture_sources = picture.find_all('source', srcset=True) if picture else []
+        srcset = image.get('srcset') or image.get('data-srcset')
+
+        source = select_srcset_candidate(picture_sources[0]['srcset']) if picture_sources else None
+        if not source and srcset:
+            source = select_srcset_candidate(srcset)
+        sources.append(source or image.get('src') or image.get('data-original'))
+
+    for element in soup.find_all(style=BACKGROUND_URL_RE):
+        sources.extend(BACKGROUND_URL_RE.findall(element['style']))
 
     images_urls = []
 
-    for image in images:
-        if image.get('src') or image.get('data-original'):
-            url = image.get('src') if image.get('src') else image.get('data-original')
-            if not url.startswith("http"):
-                url = "https:" + url
+    for source in sources:
+        url = resolve_image_url(source, base_url) if source else None
+        if url and url not in images_urls:
             images_urls.append(url)
     return images_urls
 
 
-def download_images_from_url(webpage, images_urls, status_object):
+def decode_data_uri(uri):
+    """
+    Function used to decode an inline data: URI without any network request.
+    :param uri: data: URI as a string,
+    :return: tuple of media type and decoded content as bytes.
     """
+    header, _, data = uri[len("data:"):].partition(",")
+    media_type = header.split(";")[0] or "text/plain"
+    if header.endswith(";base64"):
+        return media_type, base64.b64decode(data)
+    return media_type, unquote_to_bytes(data)
 
+
+def scrape_text(url, status_object, budget=None):
+    """
+    Function used to retrieve text from a website.
+    :param url: website's url as a string,
+    :param status_object: an AsyncResult instance which holds current task state,
+    :param budget: DownloadBudget instance limiting the download,
+    :return: tuple of website's text as a string and a dictionary describing the decoding.
+    """
+    content, content_type = fetch_html(url, budget)
+
+    status_object.result = {"status_message": "Processing HTML file"}
+    status_object.save()
+    return parse_html(content, extract_text, content_type, url)
+
+
+def scrape_images(url, status_object, budget=None):
+    """
+    Function used to retrieve images' urls from a website.
+    :param url: website's url as a string,
+    :param status_object: an AsyncResult instance which holds current task state,
+    :param budget: DownloadBudget instance limiting the download,
+    :return: tuple of list of urls as strings and a dictionary describing the decoding.
+    """
+    content, content_type = fetch_html(url, budget)
+
+    status_object.result = {"status_message": "Processing HTML file"}
+    status_object.save()
+    return parse_html(content, partial(extract_images_urls, page_url=url), content_type, url)
+
+
+def download_images_from_url(webpage, images_urls, status_object, budget=None):
+    """
+    Function used to download images and save them as Image instances.
+    Inline data: URIs are decoded instead of being downloaded and responses which are not images are skipped.
+    Downloading stops once the budget is used up, keeping images saved so far.
+    Images which fail to download or to be saved in the storage are counted as failures.
     :param webpage: instance of WebPage class,
     :param images_urls: list of urls as strings,
     :param status_object: an AsyncResult instance which holds current task state,
-    :return: dictionary holding counts of successful and failed image downloads.
+    :param budget: DownloadBudget instance, limits from settings are used if not given,
+    :return: dictionary holding counts of successful, failed and skipped image downloads
+    and the reason for stopping early, if any.
     """
-    result = {"download_success": 0, "download_failure": 0}
+    budget = budget or DownloadBudget.from_settings()
+    result = {"download_success": 0, "download_failure": 0, "download_skipped": 0, "stop_reason": None}
     images_number = len(images_urls)
     current_number = 1
     for url in images_urls:
+        try:
+            budget.check()
+        except BudgetExceeded as e:
+            result["stop_reason"] = str(e)
+            break
+
         status_object.result = {"status_message": f"Downloaded {current_number} / {images_number} images"}
         status_object.save()
         current_number += 1
 
-        file_name = url.split('/')[-1]
         try:
-            response = requests.get(url, stream=True)
-        except requests.exceptions.InvalidURL:
+            if url.startswith("data:"):
+                try:
+                    media_type, data = decode_data_uri(url)
+                except ValueError:
+                    result["download_failure"] += 1
+                    continue
+                if not media_type.startswith("image/"):
+                    result["download_skipped"] += 1
+                    continue
+                budget.consume(len(data), len(data))
+                extension = mimetypes.guess_extension(media_type) or ""
+                file_name = f"inline-{hashlib.sha1(data).hexdigest()[:12]}{extension}"
+                save_image(webpage, file_name, ContentFile(data, name=file_name))
+            else:
+                file_name = os.path.basename(urlparse(url).path) or "image"
+                response = requests.get(url, stream=True, timeout=budget.timeout)
+                try:
+                    content_type = response.headers.get("Content-Type", "")
+                    if content_type and not content_type.startswith("image/"):
+                        result["download_skipped"] += 1
+                        continue
+                    save_image(webpage, file_name, write_image(response, budget))
+                finally:
+                    # Streamed responses hold their pooled connection until they are closed.
+                    response.close()
+        except (requests.exceptions.RequestException, *STORAGE_ERRORS):
             result["download_failure"] += 1
             continue
-        else:
-            temp_file = write_image(response)
+        except ImageTooLarge:
+            result["download_skipped"] += 1
+            continue
+        except BudgetExceeded as e:
+            result["stop_reason"] = str(e)
+            break
 
-            image = Image(webpage=webpage)
-            image.image.save(file_name, File(temp_file))
-            image.save()
-            result["download_success"] += 1
+        budget.images += 1
+        result["download_success"] += 1
     return result
 
 
-def write_image(response):
+def save_image(webpage, file_name, image_file):
     """
-    Function to save response data into a temporary file.
-    :param response: response from image resource url,
-    :return: temporary image file to be saved as an Image instance.
+    Function used to save an image file in the storage and create its Image instance.
+    A partially saved file is removed if reading the image fails midway,
+    files which already existed under the same name are never removed.
+    :param webpage: instance of WebPage class,
+    :param file_name: name of the image file,
+    :param image_file: File instance with image's content.
     """
-    temp_file = NamedTemporaryFile(delete=True)
+    image = Image(webpage=webpage)
+    field = image.image.field
+    storage = image.image.storage
+    name = storage.get_available_name(field.generate_filename(image, file_name), max_length=field.max_length)
+    # Storages allowing overwrites return names of existing files, these belong to other images.
+    created = not storage.exists(name)
+    try:
+        image.image.name = storage.save(name, image_file, max_length=field.max_length)
+    except Exception:
+        if created and storage.exists(name):
+            storage.delete(name)
+        raise
+    image.save()
 
-    for block in response.iter_content(1024 * 8):
-        if not block:
-            break
-        temp_file.write(block)
-    return temp_file
+
+class ImageStream(io.IOBase):
+    """
+    Read-only, non-seekable file-like object passing response data straight to the storage.
+    Budget is enforced on every block read, so oversized downloads stop as soon as a limit is crossed,
+    and a read blocked on a slow server is interrupted once the deadline passes.
+    """
+
+    def __init__(self, response, budget=None, block_size=8 * 1024):
+        super().__init__()
+        self.response = response
+        self.budget = budget
+        self.watchdog = DeadlineWatchdog(response, budget)
+        self.blocks = iter(response.iter_content(block_size))
+        self.buffer = bytearray()
+        self.size = 0
+
+    def next_block(self):
+        try:
+            block = next(self.blocks, None)
+        except requests.exceptions.RequestException:
+            if self.watchdog.expired:
+                raise BudgetExceeded("deadline reached")
+            raise
+        # Content cut short by the watchdog must not be saved as a complete image.
+        if self.watchdog.expired:
+            raise BudgetExceeded("deadline reached")
+        return block
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self.buffer) < size:
+            block = self.next_block()
+            if not block:
+                break
+            self.size += len(block)
+            if self.budget:
+                self.budget.consume(len(block), self.size)
+            self.buffer.extend(block)
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.watchdog.cancel()
+        self.response.close()
+        super().close()
+
+
+def write_image(response, budget=None):
+    """
+    Function to wrap response data into a file which is streamed to the storage without a temporary file.
+    :param response: response from image resource url,
+    :param budget: DownloadBudget instance which accounts downloaded bytes and stops oversized downloads,
+    :return: image file to be saved as an Image instance.
+    """
+    if budget:
+        content_length = response.headers.get("Content-Length", "")
+        if content_length.isdigit():
+            budget.check_image_size(int(content_length))
+    return File(ImageStream(response, budget))
@@ -1,10 +1,16 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .budget import DownloadBudget
+from .cache import WEBPAGE_LIST_VERSION_KEY, cached_response, webpage_version_key
+from .export import get_export_queryset, iter_ndjson, iter_records
 from .serializers import AsyncResultSerializer, WebPageSerializer
 from .tasks import download_images, download_text
 from ..models import AsyncResults, WebPage
@@ -14,7 +20,17 @@ class TextScrapeView(APIView):
 
     def post(self, request):
         url = request.data["url"]
-        task = download_text.delay(url)
+        rescrape_interval = request.data.get("rescrape_interval")
+        if rescrape_interval is not None:
+            if not str(rescrape_interval).isdigit() or int(rescrape_interval) == 0:
+                return Response({"error_message": "rescrape_interval must be a positive number of seconds"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            max_interval = int(settings.SCRAPER_MAX_RESCRAPE_INTERVAL.total_seconds())
+            if int(rescrape_interval) > max_interval:
+                return Response({"error_message": f"rescrape_interval must not be longer than {max_interval} seconds"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            rescrape_interval = int(rescrape_interval)
+        task = download_text.delay(url, rescrape_interval)
         response = {
             "url": url,
             "task_id": task.task_id,
@@ -28,7 +44,12 @@ class ImageScrapeView(APIView):
 
     def post(self, request):
         url = request.data["url"]
-        task = download_images.delay(url)
+        budget = request.data.get("budget")
+        if budget is not None:
+            error_message = DownloadBudget.validate_overrides(budget)
+            if error_message:
+                return Response({"error_message": error_message}, status=status.HTTP_400_BAD_REQUEST)
+        task = download_images.delay(url, budget)
         response = {
             "url": url,
             "task_id": task.task_id,
@@ -46,18 +67,43 @@ class WebPageListView(APIView, LimitOffsetPagination):
         return self.paginate_queryset(webpages, self.request)
 
     def get(self, request):
-        webpages = self.get_queryset(request=request)
-        serializer = WebPageSerializer(webpages, context={"request": request}, many=True)
+        def build_payload():
+            webpages = self.get_queryset(request=request)
+            serializer = WebPageSerializer(webpages, context={"request": request}, many=True)
+            return self.get_paginated_response(serializer.data).data
 
-        return self.get_paginated_response(serializer.data)
+        return cached_response(request, WEBPAGE_LIST_VERSION_KEY, build_payload)
 
 
 class WebPageDetailView(APIView):
 
     def get(self, request, pk):
-        webpage = get_object_or_404(WebPage, pk=pk)
-        serializer = WebPageSerializer(webpage, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def build_payload():
+            webpage = get_object_or_404(WebPage, pk=pk)
+            serializer = WebPageSerializer(webpage, context={"request": request})
+            return serializer.data
+
+        return cached_response(request, webpage_version_key(pk), build_payload,
+                               exists=lambda: WebPage.objects.filter(pk=pk).exists())
+
+
+class WebPageExportView(APIView):
+
+    def get(self, request):
+        since_id = request.query_params.get("since_id")
+        since = request.query_params.get("since")
+        if since_id is not None and not since_id.isdigit():
+            return Response({"error_message": "since_id must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error_message": "since must be an ISO 8601 datetime"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        webpages = get_export_queryset(since_id=since_id, since=since)
+        response = StreamingHttpResponse(iter_ndjson(iter_records(webpages)), content_type="application/x-ndjson")
+        response["Content-Disposition"] = 'attachment; filename="webpages.ndjson"'
+        return response
 
 
 class TaskStatusDetailView(APIView):
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ScraperConfig(AppConfig):
     name = 'scraper'
+
+    def ready(self):
+        from . import signals  # noqa: F401
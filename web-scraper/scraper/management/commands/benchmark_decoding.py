@@ -0,0 +1,65 @@
+import time
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from ...api.encoding import decode_html, get_domain_encoding, remember_domain_encoding
+
+SAMPLES = [
+    ("utf-8", "Zażółć gęślą jaźń. Съешь же ещё этих мягких французских булок. いろはにほへと"),
+    ("iso-8859-2", "Zażółć gęślą jaźń, pchnąć w tę łódź jeża lub ośm skrzyń fig."),
+    ("windows-1251", "Съешь же ещё этих мягких французских булок, да выпей чаю."),
+    ("shift_jis", "いろはにほへと ちりぬるを わかよたれそ つねならむ"),
+    ("utf-16", "Zażółć gęślą jaźń. Съешь же ещё этих булок. いろはにほへと"),
+]
+
+
+def build_corpus(pages):
+    """
+    Function used to build a corpus of HTML pages in several encodings, declared in a header,
+    a <meta> tag or not at all.
+    :param pages: number of pages in the corpus,
+    :return: list of tuples of original text, raw content, Content-Type header and page url.
+    """
+    corpus = []
+    for i in range(pages):
+        encoding, sample = SAMPLES[i % len(SAMPLES)]
+        declaration = i // len(SAMPLES) % 3
+        meta = f'<meta charset="{encoding}">' if declaration == 1 else ""
+        text = f"<html><head>{meta}<title>{i}</title></head><body>{f'<p>{sample}</p>' * 200}</body></html>"
+        content_type = f"text/html; charset={encoding}" if declaration == 0 else "text/html"
+        corpus.append((text, text.encode(encoding), content_type, f"http://{encoding}.test/{i}"))
+    return corpus
+
+
+class Command(BaseCommand):
+    help = "Compares decoding HTML with decode_html against BeautifulSoup's own detection on a multi-encoding corpus."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=150)
+
+    # Encodings of the corpus' fake domains are remembered in a private cache, never in the shared one.
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                           "LOCATION": "benchmark-decoding"}})
+    def handle(self, *args, **options):
+        corpus = build_corpus(options["pages"])
+        expected_texts = [BeautifulSoup(text, "lxml").body.text for text, *_ in corpus]
+
+        def soup_detection(content, content_type, url):
+            return BeautifulSoup(content, "lxml")
+
+        def fast_path(content, content_type, url):
+            text, decoding = decode_html(content, content_type, get_domain_encoding(url))
+            remember_domain_encoding(url, decoding)
+            return BeautifulSoup(text, "lxml")
+
+        for name, parse in [("BeautifulSoup detection", soup_detection), ("decode_html", fast_path)]:
+            correct = 0
+            start = time.perf_counter()
+            for (text, content, content_type, url), expected_text in zip(corpus, expected_texts):
+                soup = parse(content, content_type, url)
+                correct += soup.body.text == expected_text
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{name}: {len(corpus)} pages in {elapsed:.2f}s, "
+                              f"{correct} / {len(corpus)} decoded correctly")
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from ...api.util import extract_images_urls, extract_text, run_parser
+
+
+def build_corpus(pages):
+    """
+    Function used to build a mixed corpus of HTML pages: text heavy, image heavy and large nested documents.
+    :param pages: number of pages in the corpus,
+    :return: list of HTML contents as bytes.
+    """
+    templates = [
+        "<p>{i} Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 200,
+        '<img src="/img/{i}.png" alt="{i}"><span>caption</span>' * 300,
+        "<div><ul><li><a href='/{i}'>link</a></li></ul><script>var a = 1;</script></div>" * 2000,
+    ]
+    corpus = []
+    for i in range(pages):
+        body = templates[i % len(templates)].format(i=i)
+        corpus.append(f"<html><head><title>{i}</title></head><body>{body}</body></html>".encode())
+    return corpus
+
+
+class Command(BaseCommand):
+    help = "Measures combined fetch and parse throughput of scraping tasks on a mixed HTML corpus."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=60)
+        parser.add_argument("--threads", type=int, default=20,
+                            help="Number of worker threads, as with celery --pool=threads --concurrency.")
+        parser.add_argument("--processes", type=int, default=4, help="Number of parsing processes.")
+        parser.add_argument("--latency", type=float, default=0.2, help="Simulated network latency in seconds.")
+
+    def handle(self, *args, **options):
+        corpus = build_corpus(options["pages"])
+        parsers = [extract_text, partial(extract_images_urls, page_url="http://benchmark.test/")]
+
+        def scrape(index):
+            # Stand-in for fetch_html, which only waits on the network.
+            time.sleep(options["latency"])
+            return run_parser(parsers[index % len(parsers)], corpus[index])
+
+        for processes in (0, options["processes"]):
+            with override_settings(SCRAPER_PARSE_PROCESSES=processes):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                    list(executor.map(scrape, range(len(corpus))))
+                elapsed = time.perf_counter() - start
+
+            mode = f"{processes} parsing processes" if processes else "inline parsing"
+            self.stdout.write(f"{mode}: {len(corpus)} pages in {elapsed:.2f}s "
+                              f"({len(corpus) / elapsed:.1f} pages/s)")
@@ -0,0 +1,179 @@
+import base64
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from ...api.tasks import download_images, download_text
+from ...models import AsyncResults
+
+PNG_IMAGE = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")
+
+
+class StubOriginHandler(BaseHTTPRequestHandler):
+    """Serves generated pages under /page/<number> and images under /img/<name>.png."""
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path.startswith("/page/"):
+            number = self.path.split("/")[2]
+            images = "".join(f'<img src="/img/{number}-{i}.png">' for i in range(self.server.images_per_page))
+            paragraphs = f"<p>Page {number} paragraph of benchmark text.</p>" * 200
+            body = f'<html><head><meta charset="utf-8"></head><body>{paragraphs}{images}</body></html>'.encode()
+            content_type = "text/html; charset=utf-8"
+        elif self.path.startswith("/img/"):
+            body = PNG_IMAGE
+            content_type = "image/png"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else None
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def run_task(task, url):
+    """
+    Function used to run a task eagerly in the current thread, like a worker of the threads pool would.
+    :return: tuple of task's latency in seconds, number of database queries and whether the task failed.
+    """
+    db_connection = connections["default"]
+    with CaptureQueriesContext(db_connection) as queries:
+        start = time.perf_counter()
+        outcome = task.apply(args=(url,))
+        latency = time.perf_counter() - start
+    task_status = AsyncResults.objects.filter(task_id=outcome.id).first()
+    db_connection.close()
+    failed = outcome.failed() or task_status is None or task_status.result.get("status_code") != 200
+    return latency, len(queries), failed
+
+
+def run_stage(task, urls, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = list(executor.map(lambda url: run_task(task, url), urls))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(outcome[0] for outcome in outcomes)
+    queries = sum(outcome[1] for outcome in outcomes)
+    return {
+        "tasks": len(urls),
+        "failures": sum(outcome[2] for outcome in outcomes),
+        "elapsed": elapsed,
+        "tasks_per_minute": len(urls) / elapsed * 60,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": latencies[-1],
+        "queries": queries,
+        "queries_per_task": queries / len(urls),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Drives download_text and download_images against a local stub origin and reports throughput, "
+            "latency percentiles, database queries and peak memory. Tasks run in a throwaway test database "
+            "of the configured engine, set POSTGRES_DB (and POSTGRES_HOST etc.) to benchmark PostgreSQL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=100)
+        parser.add_argument("--images-per-page", type=int, default=5)
+        parser.add_argument("--workers", type=int, default=8, help="Number of concurrently running tasks.")
+        parser.add_argument("--latency", type=float, default=0.05, help="Stub origin response delay in seconds.")
+        parser.add_argument("--output-dir", default=os.path.join(settings.BASE_DIR, "benchmark-results"))
+        parser.add_argument("--compare", help="Path of a previous result to compare with.")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubOriginHandler)
+        server.latency = options["latency"]
+        server.images_per_page = options["images_per_page"]
+        Thread(target=server.serve_forever, daemon=True).start()
+        origin = f"http://127.0.0.1:{server.server_address[1]}"
+        urls = [f"{origin}/page/{i}" for i in range(options["pages"])]
+
+        with TemporaryDirectory() as temp_dir, override_settings(MEDIA_ROOT=temp_dir):
+            if connection.vendor == "sqlite":
+                # A file database, unlike the default in-memory one, shows locking between concurrent writers.
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(temp_dir, "benchmark.sqlite3")
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            tracemalloc.start()
+            try:
+                stages = {
+                    "download_text": run_stage(download_text, urls, options["workers"]),
+                    "download_images": run_stage(download_images, urls, options["workers"]),
+                }
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                server.shutdown()
+
+        result = {
+            "timestamp": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "pages": options["pages"],
+            "images_per_page": options["images_per_page"],
+            "workers": options["workers"],
+            "latency": options["latency"],
+            "parse_processes": settings.SCRAPER_PARSE_PROCESSES,
+            "peak_memory_bytes": peak_memory,
+            "stages": stages,
+        }
+
+        os.makedirs(options["output_dir"], exist_ok=True)
+        output_path = os.path.join(options["output_dir"], f"{time.strftime('%Y%m%d-%H%M%S')}-{connection.vendor}.json")
+        with open(output_path, "w") as file:
+            json.dump(result, file, indent=2)
+
+        for name, stage in stages.items():
+            self.stdout.write(
+                f"{name}: {stage['tasks']} tasks, {stage['failures']} failed, "
+                f"{stage['tasks_per_minute']:.0f} tasks/min, "
+                f"p50 {stage['latency_p50'] * 1000:.0f} ms, p90 {stage['latency_p90'] * 1000:.0f} ms, "
+                f"p99 {stage['latency_p99'] * 1000:.0f} ms, {stage['queries_per_task']:.1f} queries/task")
+        self.stdout.write(f"peak traced memory: {peak_memory / 1024 / 1024:.1f} MiB")
+        self.stdout.write(f"results saved in {output_path}")
+
+        if options["compare"]:
+            self.compare(result, options["compare"])
+
+    def compare(self, result, previous_path):
+        with open(previous_path) as file:
+            previous = json.load(file)
+
+        for name, stage in result["stages"].items():
+            previous_stage = previous["stages"].get(name)
+            if not previous_stage:
+                continue
+            for metric in ["tasks_per_minute", "latency_p50", "latency_p99", "queries_per_task"]:
+                old, new = previous_stage[metric], stage[metric]
+                change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+                self.stdout.write(f"{name} {metric}: {old:.3f} -> {new:.3f} ({change})")
+        old_memory, new_memory = previous["peak_memory_bytes"], result["peak_memory_bytes"]
+        self.stdout.write(f"peak_memory_bytes: {old_memory} -> {new_memory} "
+                          f"({(new_memory - old_memory) / old_memory * 100:+.1f}%)")
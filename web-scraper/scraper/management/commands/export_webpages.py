@@ -0,0 +1,97 @@
+import tarfile
+from itertools import islice
+from tempfile import NamedTemporaryFile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from ...api.export import get_export_queryset, iter_ndjson, iter_records
+
+
+def write_ndjson(records, file):
+    for line in iter_ndjson(records):
+        file.write(line.encode())
+
+
+def write_parquet(records, file, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise CommandError("Parquet export requires pyarrow to be installed")
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("url", pa.string()),
+        ("text", pa.string()),
+        ("updated_at", pa.string()),
+        ("images", pa.list_(pa.string())),
+    ])
+    with pq.ParquetWriter(file, schema) as writer:
+        while True:
+            batch = list(islice(records, chunk_size))
+            if not batch:
+                break
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+class Command(BaseCommand):
+    help = "Exports scraped webpages as NDJSON or Parquet, optionally bundled with their images in a tar archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Output file path, '-' writes NDJSON to standard output.")
+        parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+        parser.add_argument("--since-id", type=int, help="Export only webpages with a greater id.")
+        parser.add_argument("--since", help="Export only webpages updated after this ISO 8601 datetime.")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--images", action="store_true",
+                            help="Write a tar archive holding the data file and all exported images.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since must be an ISO 8601 datetime")
+
+        webpages = get_export_queryset(since_id=options["since_id"], since=since)
+        exported = {"count": 0, "last_id": None, "last_updated_at": None}
+        images_names = []
+
+        def records():
+            for record in iter_records(webpages, chunk_size=options["chunk_size"]):
+                exported["count"] += 1
+                exported["last_id"] = record["id"]
+                exported["last_updated_at"] = max(exported["last_updated_at"] or "", record["updated_at"])
+                if options["images"]:
+                    images_names.extend(record["images"])
+                yield record
+
+        def write_data(file):
+            if options["format"] == "parquet":
+                write_parquet(records(), file, options["chunk_size"])
+            else:
+                write_ndjson(records(), file)
+
+        if options["output"] == "-":
+            if options["format"] != "ndjson" or options["images"]:
+                raise CommandError("Only a plain NDJSON export can be written to standard output")
+            for line in iter_ndjson(records()):
+                self.stdout.write(line, ending="")
+        elif options["images"]:
+            with tarfile.open(options["output"], "w") as archive, NamedTemporaryFile() as data_file:
+                write_data(data_file)
+                data_file.flush()
+                archive.add(data_file.name, arcname=f"webpages.{options['format']}")
+                for name in images_names:
+                    info = tarfile.TarInfo(f"images/{name}")
+                    info.size = default_storage.size(name)
+                    with default_storage.open(name) as image_file:
+                        archive.addfile(info, image_file)
+        else:
+            with open(options["output"], "wb") as file:
+                write_data(file)
+
+        self.stderr.write(f"Exported {exported['count']} webpages, last id: {exported['last_id']}, "
+                          f"last updated at: {exported['last_updated_at']}")
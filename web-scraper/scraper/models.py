@@ -5,6 +5,12 @@ from jsonfield import JSONField
 class WebPage(models.Model):
     url = models.CharField(max_length=2083, unique=True)
     text = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    last_fetched_at = models.DateTimeField(blank=True, null=True)
+    next_fetch_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    rescrape_interval = models.DurationField(blank=True, null=True)
+    rescrape_current_interval = models.DurationField(blank=True, null=True)
 
     class Meta:
         verbose_name = "Web Page"
@@ -14,6 +20,20 @@ class WebPage(models.Model):
         return self.url
 
 
+class WebPageChange(models.Model):
+    webpage = models.ForeignKey("WebPage", on_delete=models.CASCADE, related_name="changes")
+    content_hash = models.CharField(max_length=64)
+    diff = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Web Page Change"
+        verbose_name_plural = "Web Page Changes"
+
+    def __str__(self):
+        return f"{self.webpage.url} {self.created_at}"
+
+
 def upload_location(instance, filename):
     return f"{instance.webpage.id}/{filename}"
 
@@ -0,0 +1,20 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .api.cache import invalidate_webpage
+from .models import Image, WebPage
+
+
+# Cache is invalidated after the transaction commits, otherwise a request coming in before the commit
+# could cache the old data under the new version token.
+@receiver([post_save, post_delete], sender=WebPage)
+def invalidate_webpage_cache(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_webpage, instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Image)
+def invalidate_image_webpage_cache(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_webpage, instance.webpage_id))
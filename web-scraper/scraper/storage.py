@@ -0,0 +1,24 @@
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+
+
+class ImageStorage(S3Boto3Storage):
+    """
+    S3 compatible storage for scraped images.
+    Content is uploaded as it is read, without seeking, so images are streamed from the download
+    and large ones are sent in multipart chunks uploaded in parallel.
+    """
+
+    def __init__(self, **settings_overrides):
+        super().__init__(**settings_overrides)
+        self.transfer_config = TransferConfig(**settings.SCRAPER_UPLOAD_TRANSFER)
+
+    def _save(self, name, content):
+        cleaned_name = self._clean_name(name)
+        name = self._normalize_name(cleaned_name)
+        params = self._get_write_parameters(name, content)
+
+        obj = self.bucket.Object(self._encode_name(name))
+        obj.upload_fileobj(content, ExtraArgs=params, Config=self.transfer_config)
+        return cleaned_name
@@ -1,15 +1,58 @@
+import json
 import os
 import shutil
-from unittest.mock import patch
-
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import requests
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+from django.core.cache import cache
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from requests.exceptions import InvalidURL
-from rest_framework.test import APITestCase
-
-from .api.util import download_images_from_url, scrape_images, scrape_text
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from .api import util
+from .api.budget import BudgetExceeded, DownloadBudget
+from .api.cache import webpage_version_key
+from .api.changes import save_text, schedule_next_fetch
+from .api.encoding import decode_html, get_domain_encoding
+from .api.serializers import ImageSerializer
+from .api.tasks import rescrape_due_webpages
+from .api.util import download_images_from_url, extract_images_urls, fetch_html, scrape_images, scrape_text
 from .models import AsyncResults, Image, WebPage
+from .storage import ImageStorage
+
+
+class FakeObjectStorage(Storage):
+    """In-process stand-in for an object storage, keeping uploaded objects in memory."""
+    objects = {}
+
+    def _save(self, name, content):
+        # Object storages read uploads sequentially, so the content is never seeked.
+        self.objects[name] = b"".join(iter(lambda: content.read(4), b""))
+        return name
+
+    def exists(self, name):
+        return name in self.objects
+
+    def delete(self, name):
+        self.objects.pop(name, None)
+
+    def url(self, name):
+        return f"https://objects.test/bucket/{name}"
 
 
 class UtilFunctionsTestCase(APITestCase):
@@ -46,9 +89,10 @@ class UtilFunctionsTestCase(APITestCase):
         """
         # 1st case
         mocked_get.return_value.status_code = 200
-        mocked_get.return_value.content = self.html_content
+        mocked_get.return_value.iter_content.return_value = [self.html_content.encode()]
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
 
-        text = scrape_text(self.url, self.async_task)
+        text, decoding = scrape_text(self.url, self.async_task)
 
         expected = '\n\n\nTest File\n\n\n\n\n\nThis is a simple HTML test file.\n\nWe scrape it for text and ' \
                    'images\n\n\n\nRemoving all the tags\nscript and style tags are decomposed\n\n'
@@ -59,6 +103,66 @@ class UtilFunctionsTestCase(APITestCase):
         mocked_get.return_value.status_code = 500
         self.assertRaises(ConnectionError, scrape_text, self.url, self.async_task)
 
+    @override_settings(SCRAPER_PARSE_PROCESSES=1)
+    @patch('scraper.api.util.requests.get')
+    def test_scrape_text_in_parse_pool(self, mocked_get):
+        """
+        Testing that scrape_text function returns the same text when HTML is parsed in a separate process.
+        Requests.get is mocked to return our predefined HTML file as bytes.
+        """
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.iter_content.return_value = [self.html_content.encode()]
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
+
+        text, decoding = scrape_text(self.url, self.async_task)
+
+        expected = '\n\n\nTest File\n\n\n\n\n\nThis is a simple HTML test file.\n\nWe scrape it for text and ' \
+                   'images\n\n\n\nRemoving all the tags\nscript and style tags are decomposed\n\n'
+
+        self.assertEqual(text, expected)
+
+    @override_settings(SCRAPER_PARSE_PROCESSES=1)
+    @patch('scraper.api.util.requests.get')
+    def test_scrape_text_in_broken_parse_pool(self, mocked_get):
+        """
+        Testing that scrape_text function replaces a process pool broken by a dead process and parses again.
+        Requests.get is mocked to return our predefined HTML file as bytes.
+        """
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.iter_content.return_value = [self.html_content.encode()]
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
+        broken_pool = MagicMock()
+        broken_pool.submit.return_value.result.side_effect = BrokenProcessPool
+        broken_pool._processes = {}
+        util._parse_pool = broken_pool
+
+        text, decoding = scrape_text(self.url, self.async_task)
+
+        self.assertIn('This is a simple HTML test file.', text)
+        self.assertIsNot(util._parse_pool, broken_pool)
+
+    @override_settings(SCRAPER_PARSE_PROCESSES=1)
+    def test_reset_parse_pool(self):
+        """
+        Testing that reset_parse_pool function:
+        1) leaves a pool which already replaced the failed one, e.g. after another thread's reset,
+        2) drops and terminates processes of the current pool when it is the failed one.
+        """
+        failed_pool = MagicMock(_processes={})
+        current_pool = MagicMock(_processes={1: MagicMock()})
+        util._parse_pool = current_pool
+
+        # 1st case
+        util.reset_parse_pool(failed_pool)
+        self.assertIs(util.get_parse_pool(), current_pool)
+        current_pool.shutdown.assert_not_called()
+
+        # 2nd case
+        util.reset_parse_pool(current_pool)
+        self.assertIsNone(util._parse_pool)
+        current_pool.shutdown.assert_called_once_with(wait=False)
+        current_pool._processes[1].terminate.assert_called_once()
+
     @patch('scraper.api.util.requests.get')
     def test_scrape_images(self, mocked_get):
         """
@@ -69,9 +173,10 @@ class UtilFunctionsTestCase(APITestCase):
         """
         # 1st case
         mocked_get.return_value.status_code = 200
-        mocked_get.return_value.content = self.html_content
+        mocked_get.return_value.iter_content.return_value = [self.html_content.encode()]
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
 
-        images = scrape_images(self.url, self.async_task)
+        images, decoding = scrape_images(self.url, self.async_task)
 
         expected = ['http://test-url.pl/test-image.jpg', 'http://test-url.pl/test-image2.jpg']
         self.assertEqual(images, expected)
@@ -92,7 +197,7 @@ class UtilFunctionsTestCase(APITestCase):
         Mocked write_image function from util file to return a SimpleUploadedFile to imitate a real file.
         """
         # 1st case
-        mocked_get.return_value = True
+        mocked_get.return_value.headers = {"Content-Type": "image/jpeg"}
         write_image.return_value = SimpleUploadedFile("test-image.jpg", b"file_content",
                                                       content_type="image/jpeg")
         images_urls = ['http://test-url.pl/test-image.jpg', 'http://test-url.pl/test-image2.jpg']
@@ -112,6 +217,461 @@ class UtilFunctionsTestCase(APITestCase):
         self.assertEqual(result["download_success"], 0)
         self.assertEqual(result["download_failure"], 2)
 
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_from_url_budget(self, mocked_get):
+        """
+        Testing that download_images_from_url function:
+        1) skips images larger than the per-image limit,
+        2) stops when the image count limit is reached, keeping images downloaded so far and the reason.
+        Requests.get is mocked to return a response streaming 10 bytes.
+        """
+        mocked_get.return_value.headers = {"Content-Type": "image/jpeg"}
+        mocked_get.return_value.iter_content.return_value = [b"x" * 10]
+        images_urls = ['http://test-url.pl/1.jpg', 'http://test-url.pl/2.jpg', 'http://test-url.pl/3.jpg']
+
+        # 1st case
+        budget = DownloadBudget(max_image_bytes=5)
+        result = download_images_from_url(self.webpage, images_urls, self.async_task, budget)
+        self.assertEqual(result["download_skipped"], 3)
+        self.assertIsNone(result["stop_reason"])
+
+        # 2nd case
+        budget = DownloadBudget(max_images=2)
+        result = download_images_from_url(self.webpage, images_urls, self.async_task, budget)
+        self.assertEqual(result["download_success"], 2)
+        self.assertEqual(result["stop_reason"], "image count limit reached")
+        self.assertEqual(budget.total_bytes, 20)
+
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_from_slow_server(self, mocked_get):
+        """
+        Testing that download_images_from_url function stops at the deadline while a read
+        from a server trickling data is blocked, instead of waiting for the read to finish.
+        Requests.get is mocked to return a response whose second block only arrives once its socket is shut down.
+        """
+        socket_shut_down = threading.Event()
+
+        def slow_blocks(block_size):
+            yield b"x" * 10
+            socket_shut_down.wait(10)
+            raise requests.exceptions.ConnectionError("connection closed")
+
+        mocked_get.return_value.headers = {"Content-Type": "image/jpeg"}
+        mocked_get.return_value.iter_content.side_effect = slow_blocks
+        mocked_get.return_value.raw._connection.sock.shutdown.side_effect = lambda how: socket_shut_down.set()
+
+        started_at = time.monotonic()
+        result = download_images_from_url(self.webpage, ['http://test-url.pl/slow.jpg'], self.async_task,
+                                          DownloadBudget(deadline=0.2))
+
+        self.assertEqual(result["stop_reason"], "deadline reached")
+        self.assertEqual(result["download_success"], 0)
+        self.assertLess(time.monotonic() - started_at, 5)
+
+    @patch('scraper.api.util.requests.get')
+    def test_fetch_html_budget(self, mocked_get):
+        """
+        Testing that fetch_html function:
+        1) streams the website with timeouts from the budget,
+        2) stops downloading a website larger than the HTML size limit and closes the response.
+        """
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
+        mocked_get.return_value.iter_content.return_value = [b"x" * 10, b"x" * 10]
+
+        # 1st case
+        budget = DownloadBudget(connect_timeout=1, read_timeout=2)
+        self.assertEqual(fetch_html(self.url, budget), (b"x" * 20, 'text/html'))
+        mocked_get.assert_called_with(self.url, stream=True, timeout=(1, 2))
+
+        # 2nd case
+        mocked_get.return_value.close.reset_mock()
+        with self.assertRaisesMessage(BudgetExceeded, "HTML page larger than 15 bytes"):
+            fetch_html(self.url, DownloadBudget(max_html_bytes=15))
+        mocked_get.return_value.close.assert_called_once()
+
+    @override_settings(DEFAULT_FILE_STORAGE='scraper.tests.FakeObjectStorage',
+                       SCRAPER_IMAGE_CDN_URL='https://cdn.test-url.pl/')
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_to_object_storage(self, mocked_get):
+        """
+        Testing that download_images_from_url function:
+        1) streams downloaded images to the storage without seeking or temporary files,
+        2) removes a partially uploaded image when its download fails midway,
+        3) image urls are served from the CDN url.
+        Requests.get is mocked to return a response streaming image's content in blocks.
+        """
+        FakeObjectStorage.objects.clear()
+        mocked_get.return_value.headers = {"Content-Type": "image/png"}
+
+        # 1st case
+        mocked_get.return_value.iter_content.return_value = [b"first-", b"second"]
+        result = download_images_from_url(self.webpage, ['http://test-url.pl/a.png'], self.async_task)
+        self.assertEqual(result["download_success"], 1)
+        self.assertEqual(FakeObjectStorage.objects, {f"{self.webpage.id}/a.png": b"first-second"})
+
+        # 2nd case
+        mocked_get.return_value.iter_content.return_value = [b"x" * 10, b"x" * 10]
+        budget = DownloadBudget(max_image_bytes=15)
+        result = download_images_from_url(self.webpage, ['http://test-url.pl/b.png'], self.async_task, budget)
+        self.assertEqual(result["download_skipped"], 1)
+        self.assertNotIn(f"{self.webpage.id}/b.png", FakeObjectStorage.objects)
+
+        # 3rd case
+        image_url = ImageSerializer(self.webpage.images.get()).data["image_url"]
+        self.assertEqual(image_url, f"https://cdn.test-url.pl/{self.webpage.id}/a.png")
+
+    @override_settings(DEFAULT_FILE_STORAGE='scraper.tests.FakeObjectStorage')
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_with_same_name(self, mocked_get):
+        """
+        Testing that download_images_from_url function:
+        1) saves images with the same file name under different names,
+        2) keeps saved images when a download of an image with the same name fails midway,
+        3) keeps existing files when the storage returns their names for overwriting.
+        Requests.get is mocked to return a response streaming image's content in blocks.
+        """
+        FakeObjectStorage.objects.clear()
+        mocked_get.return_value.headers = {"Content-Type": "image/png"}
+        images_urls = ['http://test-url.pl/a.png']
+
+        # 1st case
+        mocked_get.return_value.iter_content.return_value = [b"first"]
+        download_images_from_url(self.webpage, images_urls, self.async_task)
+        mocked_get.return_value.iter_content.return_value = [b"second"]
+        download_images_from_url(self.webpage, images_urls, self.async_task)
+        names = [image.image.name for image in self.webpage.images.all()]
+        self.assertEqual(len(set(names)), 2)
+        self.assertEqual(sorted(FakeObjectStorage.objects.values()), [b"first", b"second"])
+
+        # 2nd case
+        mocked_get.return_value.iter_content.return_value = [b"x" * 10, b"x" * 10]
+        result = download_images_from_url(self.webpage, images_urls, self.async_task,
+                                          DownloadBudget(max_image_bytes=15))
+        self.assertEqual(result["download_skipped"], 1)
+        self.assertEqual(sorted(FakeObjectStorage.objects), sorted(names))
+
+        # 3rd case
+        with patch.object(FakeObjectStorage, 'get_available_name', lambda storage, name, max_length=None: name):
+            download_images_from_url(self.webpage, images_urls, self.async_task,
+                                     DownloadBudget(max_image_bytes=15))
+        self.assertEqual(FakeObjectStorage.objects[f"{self.webpage.id}/a.png"], b"first")
+
+    @override_settings(SCRAPER_IMAGE_CDN_URL='https://cdn.test-url.pl')
+    def test_image_cdn_url(self):
+        """Testing that image urls built from the CDN url are properly quoted."""
+        image = Image.objects.create(webpage=self.webpage, image=f"{self.webpage.id}/my image#1.png")
+
+        image_url = ImageSerializer(image).data["image_url"]
+
+        self.assertEqual(image_url, f"https://cdn.test-url.pl/{self.webpage.id}/my%20image%231.png")
+
+    @override_settings(DEFAULT_FILE_STORAGE='scraper.tests.FakeObjectStorage')
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_storage_errors(self, mocked_get):
+        """
+        Testing that download_images_from_url function counts images the storage failed to save
+        as failed downloads and keeps downloading the next ones.
+        Storage is patched to raise an error of an unreachable and of a refusing object storage.
+        """
+        FakeObjectStorage.objects.clear()
+        mocked_get.return_value.headers = {"Content-Type": "image/png"}
+        mocked_get.return_value.iter_content.return_value = [b"image"]
+        save = FakeObjectStorage._save
+
+        def failing_save(storage, name, content):
+            if name.endswith("down.png"):
+                raise EndpointConnectionError(endpoint_url="https://objects.test")
+            if name.endswith("denied.png"):
+                raise ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject")
+            return save(storage, name, content)
+
+        images_urls = ['http://test-url.pl/down.png', 'http://test-url.pl/denied.png', 'http://test-url.pl/a.png']
+        with patch.object(FakeObjectStorage, '_save', failing_save):
+            result = download_images_from_url(self.webpage, images_urls, self.async_task)
+
+        self.assertEqual(result["download_failure"], 2)
+        self.assertEqual(result["download_success"], 1)
+        self.assertIsNone(result["stop_reason"])
+        self.assertEqual(list(FakeObjectStorage.objects), [f"{self.webpage.id}/a.png"])
+
+    def test_extract_images_urls(self):
+        """
+        Testing that extract_images_urls function:
+        1) resolves relative sources against the <base> tag,
+        2) picks the largest srcset and <picture> candidates,
+        3) finds CSS backgrounds and keeps data: URIs,
+        4) drops duplicates and images declaring a tiny size.
+        """
+        html_content = """
+        <html><head><base href="/static/"></head><body>
+        <img src="a.png">
+        <img src="//cdn.test-url.pl/b.png">
+        <img src="small.png" srcset="small.png 480w, large.png 800w">
+        <picture><source srcset="pic.webp 1x, pic@2x.webp 2x"><img src="pic.jpg"></picture>
+        <div style="background-image: url('bg.jpg')"></div>
+        <img src="data:image/png;base64,iVBORw0KGgo=">
+        <img src="/static/a.png">
+        <img src="pixel.gif" width="1" height="1">
+        <img src="javascript:void(0)">
+        </body></html>
+        """
+
+        images = extract_images_urls(html_content, "http://test-url.pl/page/")
+
+        expected = [
+            'http://test-url.pl/static/a.png',
+            'http://cdn.test-url.pl/b.png',
+            'http://test-url.pl/static/large.png',
+            'http://test-url.pl/static/pic@2x.webp',
+            'data:image/png;base64,iVBORw0KGgo=',
+            'http://test-url.pl/static/bg.jpg',
+        ]
+        self.assertEqual(images, expected)
+
+    def test_extract_images_urls_srcset(self):
+        """
+        Testing that extract_images_urls function:
+        1) parses srcset candidates separated by commas without whitespace,
+        2) falls back to src when srcset has no valid candidate.
+        """
+        html_content = """
+        <img src="fallback.png" srcset="a.png 1x,b.png 2x">
+        <img src="only-src.png" srcset="broken.png 2q">
+        """
+
+        images = extract_images_urls(html_content, "http://test-url.pl/")
+
+        # 1st case
+        self.assertEqual(images[0], 'http://test-url.pl/b.png')
+
+        # 2nd case
+        self.assertEqual(images[1], 'http://test-url.pl/only-src.png')
+
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_closes_responses(self, mocked_get):
+        """
+        Testing that download_images_from_url function closes streamed responses
+        of skipped images which are not images or are declared too large.
+        """
+        images_urls = ['http://test-url.pl/page.html', 'http://test-url.pl/huge.png']
+        not_image = MagicMock(headers={"Content-Type": "text/html"})
+        huge_image = MagicMock(headers={"Content-Type": "image/png", "Content-Length": "100"})
+        mocked_get.side_effect = [not_image, huge_image]
+
+        result = download_images_from_url(self.webpage, images_urls, self.async_task,
+                                          DownloadBudget(max_image_bytes=10))
+
+        self.assertEqual(result["download_skipped"], 2)
+        not_image.close.assert_called_once()
+        huge_image.close.assert_called_once()
+
+    @patch('scraper.api.util.requests.get')
+    def test_download_images_from_data_uri(self, mocked_get):
+        """
+        Testing that download_images_from_url function:
+        1) saves images from data: URIs without requesting them,
+        2) skips data: URIs which are not images.
+        """
+        images_urls = ['data:image/png;base64,iVBORw0KGgo=', 'data:text/plain,hello']
+        result = download_images_from_url(self.webpage, images_urls, self.async_task)
+
+        # 1st case
+        mocked_get.assert_not_called()
+        saved_image = self.webpage.images.get()
+        self.assertTrue(saved_image.image.name.startswith(f"{self.webpage.id}/inline-"))
+        self.assertEqual(result["download_success"], 1)
+
+        # 2nd case
+        self.assertEqual(result["download_skipped"], 1)
+
+
+class ImageStorageTestCase(APITestCase):
+    """Test case class for testing ImageStorage class in storage file"""
+
+    def setUp(self):
+        """Defining variables and instances created before each test"""
+        # Bucket's client is stubbed, so no request leaves the test
+        self.storage = ImageStorage(bucket_name='images', access_key='key', secret_key='secret',
+                                    region_name='eu-central-1', default_acl=None)
+        self.client = self.storage.connection.meta.client
+        self.uploads = []
+        self.client.meta.events.register(
+            'provide-client-params.s3.PutObject',
+            lambda params, **kwargs: self.uploads.append((params['Key'], params['ContentType'], params['Body'].read())))
+
+    def test_save(self):
+        """
+        Testing that save method:
+        1) uploads content read sequentially from a non-seekable stream under the given name,
+        2) raises errors of the object storage.
+        """
+        response = MagicMock()
+        response.iter_content.return_value = [b"first-", b"second"]
+
+        # 1st case
+        with Stubber(self.client) as stubber:
+            stubber.add_response('put_object', {})
+            name = self.storage.save('1/a.png', File(util.ImageStream(response), name='a.png'))
+            stubber.assert_no_pending_responses()
+        self.assertEqual(name, '1/a.png')
+        self.assertEqual(self.uploads, [('1/a.png', 'image/png', b"first-second")])
+
+        # 2nd case
+        with Stubber(self.client) as stubber:
+            stubber.add_client_error('put_object', 'AccessDenied', http_status_code=403)
+            self.assertRaises(ClientError, self.storage.save, '1/b.png', ContentFile(b"image", name='b.png'))
+
+
+class DecodeHtmlTestCase(APITestCase):
+    """Test case class for testing decode_html function in api/encoding file"""
+
+    def setUp(self):
+        """Defining variables and instances created before each test"""
+        # Clear encodings remembered for domains by other tests
+        cache.clear()
+        self.url = 'http://test-url.pl'
+        self.text = '<html><body><p>Zażółć gęślą jaźń</p></body></html>'
+
+    def test_decode_html(self):
+        """
+        Testing that decode_html function:
+        1) uses a BOM before the Content-Type header,
+        2) uses charset from the Content-Type header,
+        3) uses charset from a <meta> tag,
+        4) ignores a declaration the content can not be decoded with and falls back to UTF-8,
+        5) decodes content labelled latin-1 as windows-1252, like browsers do.
+        """
+        # 1st case
+        text, decoding = decode_html(self.text.encode('utf-8-sig'), 'text/html; charset=iso-8859-2')
+        self.assertEqual(text, self.text)
+        self.assertEqual(decoding['encoding'], 'utf-8-sig')
+
+        # 2nd case
+        text, decoding = decode_html(self.text.encode('iso-8859-2'), 'text/html; charset=ISO-8859-2')
+        self.assertEqual(text, self.text)
+        self.assertEqual(decoding['encoding_source'], 'declared')
+
+        # 3rd case
+        content = '<meta charset="windows-1250">'.encode() + self.text.encode('windows-1250')
+        text, decoding = decode_html(content, 'text/html')
+        self.assertEqual(decoding['encoding'], 'cp1250')
+
+        # 4th case
+        text, decoding = decode_html(self.text.encode('utf-8'), 'text/html; charset=shift_jis')
+        self.assertEqual(text, self.text)
+        self.assertEqual(decoding['encoding_source'], 'utf-8')
+
+        # 5th case
+        text, decoding = decode_html('“quoted”'.encode('cp1252'), 'text/html; charset=iso-8859-1')
+        self.assertEqual(text, '“quoted”')
+        self.assertEqual(decoding['encoding'], 'cp1252')
+
+    @patch('scraper.api.util.requests.get')
+    @patch('scraper.api.encoding.chardet.detect')
+    def test_decode_html_domain_cache(self, detect, mocked_get):
+        """
+        Testing that scrape_text function:
+        1) detects encoding of undeclared content which is not UTF-8 and remembers it for the domain,
+        2) reuses the encoding detected for the same domain without detecting it again.
+        """
+        detect.return_value = {'encoding': 'ISO-8859-2'}
+        mocked_get.return_value.status_code = 200
+        mocked_get.return_value.iter_content.return_value = [self.text.encode('iso-8859-2')]
+        mocked_get.return_value.headers = {'Content-Type': 'text/html'}
+        async_task = AsyncResults.objects.create(task_id='test-1234', result={})
+
+        # 1st case
+        text, decoding = scrape_text(self.url, async_task)
+        self.assertEqual(text, 'Zażółć gęślą jaźń')
+        self.assertEqual(decoding['encoding_source'], 'detected')
+        self.assertEqual(get_domain_encoding(f'{self.url}/other-page'), 'iso8859-2')
+
+        # 2nd case
+        text, decoding = scrape_text(f'{self.url}/other-page', async_task)
+        self.assertEqual(text, 'Zażółć gęślą jaźń')
+        self.assertEqual(decoding['encoding_source'], 'domain cache')
+        detect.assert_called_once()
+
+
+class ChangeDetectionTestCase(APITestCase):
+    """Test case class for testing change detection and re-scrape scheduling in api/changes and api/tasks files"""
+
+    def setUp(self):
+        """Defining variables and instances created before each test"""
+        # Create url variable
+        self.url = 'http://test-url.pl'
+
+    def test_save_text(self):
+        """
+        Testing that save_text function:
+        1) saves text of a new webpage and records a change,
+        2) leaves the webpage untouched if the text did not change,
+        3) records a diff of changed lines.
+        """
+        # 1st case
+        webpage, changed = save_text(self.url, 'first line\nsecond line')
+        self.assertTrue(changed)
+        self.assertEqual(webpage.text, 'first line\nsecond line')
+
+        # 2nd case
+        webpage, changed = save_text(self.url, 'first line\nsecond line')
+        self.assertFalse(changed)
+        self.assertEqual(webpage.changes.count(), 1)
+
+        # 3rd case
+        webpage, changed = save_text(self.url, 'first line\nthird line')
+        self.assertTrue(changed)
+        diff = webpage.changes.latest('id').diff
+        self.assertIn('-second line', diff)
+        self.assertIn('+third line', diff)
+        self.assertNotIn('first line', diff)
+
+    def test_schedule_next_fetch(self):
+        """
+        Testing that schedule_next_fetch function:
+        1) sets the base interval and next fetch time,
+        2) doubles the interval if the page did not change,
+        3) resets the interval to the base one if the page changed.
+        """
+        webpage = WebPage.objects.create(url=self.url)
+
+        # 1st case
+        schedule_next_fetch(webpage, True, timedelta(hours=1))
+        webpage.refresh_from_db()
+        self.assertEqual(webpage.rescrape_current_interval, timedelta(hours=1))
+        self.assertAlmostEqual(webpage.next_fetch_at, timezone.now() + timedelta(hours=1), delta=timedelta(minutes=1))
+
+        # 2nd case
+        schedule_next_fetch(webpage, False)
+        schedule_next_fetch(webpage, False)
+        webpage.refresh_from_db()
+        self.assertEqual(webpage.rescrape_current_interval, timedelta(hours=4))
+
+        # 3rd case
+        schedule_next_fetch(webpage, True)
+        webpage.refresh_from_db()
+        self.assertEqual(webpage.rescrape_current_interval, timedelta(hours=1))
+
+    @patch('scraper.api.tasks.download_text')
+    def test_rescrape_due_webpages(self, download_text):
+        """
+        Testing that rescrape_due_webpages task:
+        1) queues download_text only for webpages whose next fetch time has passed,
+        2) moves their next fetch time forward so they are not queued twice.
+        """
+        WebPage.objects.create(url=self.url, next_fetch_at=timezone.now() - timedelta(minutes=1),
+                               rescrape_current_interval=timedelta(hours=1))
+        WebPage.objects.create(url='http://test-url2.pl', next_fetch_at=timezone.now() + timedelta(minutes=1),
+                               rescrape_current_interval=timedelta(hours=1))
+
+        # 1st case
+        self.assertEqual(rescrape_due_webpages(), 1)
+        download_text.delay.assert_called_once_with(self.url)
+
+        # 2nd case
+        self.assertEqual(rescrape_due_webpages(), 0)
+
 
 class TextScrapeViewTestCase(APITestCase):
     """Test case class to test api endpoints in TextScrapeView class"""
@@ -145,6 +705,32 @@ class TextScrapeViewTestCase(APITestCase):
         # 2nd case
         self.assertEqual(response.status_code, 202)
 
+    @patch('scraper.api.views.download_text')
+    def test_post_rescrape_interval(self, download_text):
+        """
+        Testing that post method:
+        1) passes a valid rescrape interval to the task,
+        2) responses with 400 status code if the interval is not a positive number,
+        3) responses with 400 status code if the interval is longer than SCRAPER_MAX_RESCRAPE_INTERVAL setting.
+        Mocked download_text function from api/tasks.py to return our predefined task_id.
+        """
+        download_text.delay.return_value.task_id = 'test-1234'
+
+        # 1st case
+        response = self.client.post(reverse('scrape-text'), data={'url': self.url, 'rescrape_interval': 3600})
+        self.assertEqual(response.status_code, 202)
+        download_text.delay.assert_called_once_with(self.url, 3600)
+
+        # 2nd case
+        response = self.client.post(reverse('scrape-text'), data={'url': self.url, 'rescrape_interval': 0})
+        self.assertEqual(response.status_code, 400)
+
+        # 3rd case
+        response = self.client.post(reverse('scrape-text'),
+                                    data={'url': self.url, 'rescrape_interval': 10000000000000})
+        self.assertEqual(response.status_code, 400)
+        download_text.delay.assert_called_once()
+
 
 class ImageScrapeViewTestCase(APITestCase):
     """Test case class to test api endpoints in ImageScrapeView class"""
@@ -178,11 +764,36 @@ class ImageScrapeViewTestCase(APITestCase):
         # 2nd case
         self.assertEqual(response.status_code, 202)
 
+    @patch('scraper.api.views.download_images')
+    def test_post_budget(self, download_images):
+        """
+        Testing that post method:
+        1) passes a valid budget to the task,
+        2) responses with 400 status code if the budget has unknown or non-positive limits.
+        """
+        download_images.delay.return_value.task_id = 'test-1234'
+
+        # 1st case
+        response = self.client.post(reverse('scrape-images'), data={'url': self.url, 'budget': {'max_images': 5}},
+                                    format='json')
+        self.assertEqual(response.status_code, 202)
+        download_images.delay.assert_called_once_with(self.url, {'max_images': 5})
+
+        # 2nd case
+        response = self.client.post(reverse('scrape-images'), data={'url': self.url, 'budget': {'max_images': 0}},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('scrape-images'), data={'url': self.url, 'budget': {'threads': 5}},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
 
 class WebPageDetailViewTestCase(APITestCase):
     """Test case class to test api endpoints in WebPageDetailView class"""
     def setUp(self):
         """Defining variables and instances created before each test"""
+        # Cache is invalidated on commit, which never happens inside a test case's transaction
+        cache.clear()
         # Create webpage instance in our database
         self.webpage = WebPage.objects.create(
             url='http://test-url.pl',
@@ -225,6 +836,71 @@ class WebPageDetailViewTestCase(APITestCase):
         response = self.client.get(reverse('webpage-detail', kwargs={'pk': 2}))
         self.assertEqual(response.status_code, 404)
 
+    def test_get_cached(self):
+        """
+        Testing that get method:
+        1) serves a repeated request from cache without querying the database,
+        2) responses with 304 status code if If-None-Match header holds the current ETag, also a weak one,
+        3) responses with 404 status code to If-None-Match: * for a missing webpage and creates no version for it.
+        """
+        url = reverse('webpage-detail', kwargs={'pk': self.webpage.id})
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        # 1st case
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['ETag'], etag)
+
+        # 2nd case
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'W/{etag}')
+        self.assertEqual(response.status_code, 304)
+
+        # 3rd case
+        response = self.client.get(reverse('webpage-detail', kwargs={'pk': 999}), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(cache.get(webpage_version_key(999)))
+
+
+class WebPageCacheInvalidationTestCase(APITransactionTestCase):
+    """Test case class to test that cached webpages are invalidated once changes are committed"""
+
+    def setUp(self):
+        """Defining variables and instances created before each test"""
+        cache.clear()
+        self.webpage = WebPage.objects.create(url='http://test-url.pl', text='Test File')
+
+    def tearDown(self):
+        """Code executed after each test"""
+        # Remove images from media folder created during tests
+        page_media_directory = f"media/{self.webpage.id}"
+        if os.path.exists(page_media_directory):
+            shutil.rmtree(page_media_directory)
+
+    def test_invalidated_on_commit(self):
+        """
+        Testing that get method:
+        1) keeps serving the cached webpage until the transaction saving its image commits,
+        2) returns new data and ETag after the transaction commits.
+        """
+        url = reverse('webpage-detail', kwargs={'pk': self.webpage.id})
+        etag = self.client.get(url)['ETag']
+
+        # 1st case
+        with transaction.atomic():
+            img = Image(webpage=self.webpage)
+            img.image.save("python2.jpg", File(open('static/python.jpg', 'rb')), save=True)
+            self.assertIsNotNone(cache.get(webpage_version_key(self.webpage.id)))
+
+        # 2nd case
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['images']), 1)
+
 
 class TaskStatusDetailViewTestCase(APITestCase):
     """Test case class to test api endpoints in TaskStatusDetailView class"""
@@ -255,3 +931,45 @@ class TaskStatusDetailViewTestCase(APITestCase):
         # 2nd case
         response = self.client.get(reverse('task-detail', kwargs={'task_id': 'non-existing-task'}))
         self.assertEqual(response.status_code, 404)
+
+
+class WebPageExportViewTestCase(APITestCase):
+    """Test case class to test api endpoints in WebPageExportView class"""
+
+    def setUp(self):
+        """Defining variables and instances created before each test"""
+        self.first_webpage = WebPage.objects.create(url='http://test-url.pl', text='First page')
+        self.second_webpage = WebPage.objects.create(url='http://test-url2.pl', text='Second page')
+
+    def test_get(self):
+        """
+        Testing that get method:
+        1) streams all webpages as NDJSON,
+        2) exports only webpages with a greater id when since_id is given,
+        3) responses with 400 status code if since is not a datetime.
+        """
+        # 1st case
+        response = self.client.get(reverse('webpage-export'))
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([record['url'] for record in records], ['http://test-url.pl', 'http://test-url2.pl'])
+        self.assertEqual(records[0]['images'], [])
+
+        # 2nd case
+        response = self.client.get(reverse('webpage-export'), {'since_id': self.first_webpage.id})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([record['id'] for record in records], [self.second_webpage.id])
+
+        # 3rd case
+        response = self.client.get(reverse('webpage-export'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_webpages_command(self):
+        """Testing that export_webpages command writes NDJSON to standard output."""
+        out = StringIO()
+        call_command('export_webpages', '-', '--chunk-size', '1', stdout=out, stderr=StringIO())
+
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['text'] for record in records], ['First page', 'Second page'])
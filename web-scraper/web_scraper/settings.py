@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import sys
+from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -38,7 +40,7 @@ INSTALLED_APPS = [
 
     'rest_framework',
 
-    'scraper'
+    'scraper.apps.ScraperConfig'
 ]
 
 MIDDLEWARE = [
@@ -82,6 +84,40 @@ DATABASES = {
     }
 }
 
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# Cached payloads are invalidated by Celery workers, so the cache has to be shared with the web process.
+# Redis is used when REDIS_URL is given, otherwise the database cache, which needs `manage.py createcachetable`.
+# Process local memory cache is only used by the test runner.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'scraper_cache',
+    }
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+elif sys.argv[1:2] == ['test']:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -128,5 +164,62 @@ STATIC_ROOT = os.path.join(os.path.dirname(BASE_DIR), "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Object storage
+# Images are kept in an S3 compatible bucket (AWS, MinIO) when a bucket name is given, otherwise in MEDIA_ROOT.
+# https://django-storages.readthedocs.io/en/latest/backends/amazon-S3.html
+
+if os.environ.get('AWS_STORAGE_BUCKET_NAME'):
+    DEFAULT_FILE_STORAGE = 'scraper.storage.ImageStorage'
+    AWS_STORAGE_BUCKET_NAME = os.environ['AWS_STORAGE_BUCKET_NAME']
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+    AWS_S3_CUSTOM_DOMAIN = os.environ.get('AWS_S3_CUSTOM_DOMAIN')
+    AWS_DEFAULT_ACL = None
+    AWS_QUERYSTRING_AUTH = False
+    # Images with the same file name get unique keys instead of replacing each other.
+    AWS_S3_FILE_OVERWRITE = False
+
+# Public base url, e.g. of a CDN, images are served from. Image urls are then built without calling the storage.
+SCRAPER_IMAGE_CDN_URL = os.environ.get('SCRAPER_IMAGE_CDN_URL')
+
+# Images larger than multipart_threshold bytes are uploaded in parts, max_concurrency of them at once.
+SCRAPER_UPLOAD_TRANSFER = {
+    'multipart_threshold': 8 * 1024 * 1024,
+    'multipart_chunksize': 8 * 1024 * 1024,
+    'max_concurrency': 4,
+}
+
 # Celery
 CELERY_BROKER_URL = 'amqp://rabbitmq'
+CELERY_BEAT_SCHEDULE = {
+    'rescrape-due-webpages': {
+        'task': 'scraper.api.tasks.rescrape_due_webpages',
+        'schedule': 60.0,
+    },
+}
+
+# Scraper
+# Number of processes used to parse fetched HTML, 0 parses it inline in the worker's thread.
+# Worker should then run with an I/O oriented pool (e.g. --pool=threads) to only wait on the network.
+SCRAPER_PARSE_PROCESSES = int(os.environ.get('SCRAPER_PARSE_PROCESSES', 0))
+# Seconds a single page may be parsed in the process pool before the task gives up on it.
+SCRAPER_PARSE_TIMEOUT = 60
+
+# Images declaring width or height below this number of pixels (e.g. tracking pixels) are not downloaded.
+SCRAPER_MIN_IMAGE_SIZE = 16
+
+# Seconds serialized webpage payloads are kept in cache, they are also dropped whenever a page or its images change.
+SCRAPER_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Upper bound of the adaptive interval between re-scrapes of a page which does not change.
+SCRAPER_MAX_RESCRAPE_INTERVAL = timedelta(days=30)
+
+# Limits of a single scrape task, from requesting the website to the last image. Scrape requests may only tighten them.
+SCRAPER_DOWNLOAD_BUDGET = {
+    'max_html_bytes': 10 * 1024 * 1024,
+    'max_total_bytes': 200 * 1024 * 1024,
+    'max_images': 500,
+    'max_image_bytes': 20 * 1024 * 1024,
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'deadline': 15 * 60,
+}